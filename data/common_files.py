@@ -8,8 +8,9 @@
 # https://www.apache.org/licenses/LICENSE-2.0
 # --------------------------------------------------------------------------- #
 """Scripts for creating files in the _common folder."""
+import numpy as np
 import pandas as pd
-from gen_utils import file_manager
+from gen_utils import excel, file_manager
 
 
 def deflator_file(world_bank_file_path: str, output_folder_path: str):
@@ -23,20 +24,19 @@ def deflator_file(world_bank_file_path: str, output_folder_path: str):
         world_bank_file_path (str): path to the WB data file, in EXCEL format.
         output_folder_path (str): output folder path.
     """
-    deflator_df = pd.read_excel(world_bank_file_path, sheet_name="Data", header=3)
-    zenodo_df = pd.DataFrame(columns=file_manager.COLUMNS)
-
+    deflator_df = pd.read_excel(world_bank_file_path, sheet_name="Data", header=3, engine=excel.ENGINE)
     years_str = [str(y) for y in range(1990, 2022)]
     years_int = list(range(1990, 2022))
-    for i in deflator_df.index:
-        country_code = deflator_df.loc[i, "Country Code"]
-        values = deflator_df.loc[i, years_str].values
 
-        tmp_df = pd.DataFrame(columns=file_manager.COLUMNS)
-        tmp_df["Year"] = years_int
-        tmp_df["Value"] = values
-        tmp_df["Country"] = country_code
-        zenodo_df = pd.concat([zenodo_df, tmp_df], ignore_index=True)
+    # Reshape the wide WB sheet (one column per year) into the long zenodo format, grouped by country
+    zenodo_df = pd.DataFrame(
+        {
+            "Country": np.repeat(deflator_df["Country Code"].to_numpy(), len(years_int)),
+            "Year": np.tile(years_int, len(deflator_df)),
+            "Value": deflator_df[years_str].to_numpy().ravel(),
+        }
+    )
+    zenodo_df = zenodo_df.reindex(columns=file_manager.COLUMNS)
 
     zenodo_df["Entity"] = "deflator"
     zenodo_df["Parameter"] = "gdp_deflator"
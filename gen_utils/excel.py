@@ -0,0 +1,18 @@
+# --------------------------------------------------------------------------- #
+# Filename: excel.py
+# Created Date: Wednesday, October 14th 2026, 5:07:38 am
+# Author: agent
+# Email: agent@local
+# Copyright (C) 2026 agent and University of Geneva
+# Apache License 2.0
+# https://www.apache.org/licenses/LICENSE-2.0
+# --------------------------------------------------------------------------- #
+"""Excel reading settings shared by data scripts and the model."""
+from importlib.util import find_spec
+
+import pandas as pd
+
+# Prefer the Rust-based calamine reader (needs python-calamine and pandas>=2.2), it is much faster than openpyxl.
+# None falls back to the pandas default.
+_PANDAS_VERSION = tuple(int(v) for v in pd.__version__.split(".")[:2])
+ENGINE = "calamine" if find_spec("python_calamine") is not None and _PANDAS_VERSION >= (2, 2) else None
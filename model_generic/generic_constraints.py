@@ -13,7 +13,7 @@ Holds standard constraints that can be re-used by sector modules.
 Rules:
 - Only use generic variables (a, ctot, cnew, cret, fin, fout).
 - Configuration: always check enable_capacity if the function uses ctot, cnew or cret.
-- Sets: only use generics (FiE, FoE).
+- Sets: only use generics (FiE, FoE, and their per-flow/per-entity views FiEbyF, FoEbyF, FiEbyE, FoEbyE).
 """
 import pyomo.environ as pyo
 
@@ -26,9 +26,8 @@ from model_utils.configuration import DATA
 def c_flow_in(model: pyo.ConcreteModel, entity_id: str, y: int, d: int, h: int):
     """Balance entity inflows to its activity."""
     inflows = sum(
-        model.fin[f, e, y, d, h] * DATA.get_fxe(e, "input_efficiency", f, y)
-        for (f, e) in model.FiE
-        if e == entity_id
+        model.fin[f, entity_id, y, d, h] * DATA.get_fxe(entity_id, "input_efficiency", f, y)
+        for f in model.FiEbyE[entity_id]
     )
     return inflows == model.a[entity_id, y, d, h]
 
@@ -66,9 +65,8 @@ def c_flow_in_share_min(model: pyo.ConcreteModel, flow_id: str, entity_id: str,
 def c_flow_out(model: pyo.ConcreteModel, entity_id: str, y: int, d: int, h: int):
     """Balance entity outflows to its activity."""
     outflows = sum(
-        model.fout[f, e, y, d, h] / DATA.get_fxe(e, "output_efficiency", f, y)
-        for (f, e) in model.FoE
-        if e == entity_id
+        model.fout[f, entity_id, y, d, h] / DATA.get_fxe(entity_id, "output_efficiency", f, y)
+        for f in model.FoEbyE[entity_id]
     )
     return outflows == model.a[entity_id, y, d, h]
 
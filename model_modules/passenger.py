@@ -32,25 +32,25 @@ def _c_travel_time_budget(model: pyo.ConcreteModel, y):
     population = cnf.DATA.get_annual("country", "actual_population", y)
     daily_time = cnf.DATA.get_annual("country", "daily_travel_time", y)
     travel_time_budget = population * daily_time * 365
-    time_travelled = 1e6 * sum(
-        model.e_TotalAnnualOutflow[f, e, y] / cnf.DATA.get_fxe(e, "speed", f, y) for f, e in model.PassTransFoE
-    )
+    speed = {(f, e): cnf.DATA.get_fxe(e, "speed", f, y) for f, e in model.PassTransFoE}
+    time_travelled = 1e6 * sum(model.e_TotalAnnualOutflow[f, e, y] / v for (f, e), v in speed.items())
     return travel_time_budget >= time_travelled
 
 
 def _sets(model: pyo.ConcreteModel):
     """Create sets used by this sector."""
-    techs = set(cnf.ENTITIES[cnf.ENTITIES.str.startswith(GROUP_ID)])
+    techs = frozenset(cnf.ENTITIES[cnf.ENTITIES.str.startswith(GROUP_ID)])
     model.PassTrans = pyo.Set(initialize=techs, ordered=False)
+    # FoE/FiE pairs are already unique, no need to deduplicate them again
     model.PassTransFoE = pyo.Set(
         within=model.F * model.E,
         ordered=False,
-        initialize={(f, e) for f, e in model.FoE if e in techs},
+        initialize=[(f, e) for f, e in model.FoE if e in techs],
     )
     model.PassTransFiE = pyo.Set(
         within=model.F * model.E,
         ordered=False,
-        initialize={(f, e) for f, e in model.FiE if e in techs},
+        initialize=[(f, e) for f, e in model.FiE if e in techs],
     )
 
 
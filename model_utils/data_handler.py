@@ -8,6 +8,7 @@
 # https://www.apache.org/licenses/LICENSE-2.0
 # --------------------------------------------------------------------------- #
 """Generic functions to deal with RESTORE configuration files."""
+import functools
 from typing import Any
 from numbers import Number
 
@@ -15,16 +16,21 @@ import pandas as pd
 import numpy as np
 
 from data.zenodo_to_cnf import CNF_INDEX
+from gen_utils import excel
 
 
 def get_flow_entity_dict(io_df: pd.DataFrame, by_entity=False) -> dict[str, list]:
     """Create a dictionary with the flows as keys, and the connected processes as the item (in list)."""
-    flows = io_df.columns
-    io_dict = {f: [] for f in flows}  # type: dict[str, list]
-    index_tuples = list(io_df.stack().index) if not by_entity else list(io_df.T.stack().index)
-    for p, f in index_tuples:
-        io_dict.setdefault(f, []).append(p)
-    return {k: v for k, v in io_dict.items() if v}  # Get rid of empty flows
+    if by_entity:
+        io_df = io_df.T
+    processes = io_df.index.to_numpy()
+    connected = io_df.notna().to_numpy()
+    io_dict = {}  # type: dict[str, list]
+    for j, f in enumerate(io_df.columns):
+        rows = np.flatnonzero(connected[:, j])
+        if rows.size:  # Skip empty flows
+            io_dict[f] = processes[rows].tolist()
+    return io_dict
 
 
 def merge_dicts(dict1: dict, dict2: dict) -> dict:
@@ -79,7 +85,19 @@ def get_lf_vre(country: str) -> dict:
     solar_pv.columns = ["PV"]
 
     vre_df = pd.concat([solar_pv, wind], axis=1)
-    result = vre_df.groupby([vre_df.index.year, vre_df.index.hour]).mean()
+
+    # Average over days within each (year, hour) cell, skipping empty values
+    cell_ids = vre_df.index.year.to_numpy() * 24 + vre_df.index.hour.to_numpy()
+    cells, cell_idx = np.unique(cell_ids, return_inverse=True)
+    values = vre_df.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    sums = np.column_stack(
+        [np.bincount(cell_idx, weights=np.where(valid[:, i], values[:, i], 0)) for i in range(values.shape[1])]
+    )
+    counts = np.column_stack([np.bincount(cell_idx, weights=valid[:, i]) for i in range(values.shape[1])])
+    with np.errstate(invalid="ignore"):
+        means = sums / counts
+    result = pd.DataFrame(means, index=pd.MultiIndex.from_arrays([cells // 24, cells % 24]), columns=vre_df.columns)
 
     col_fix = {
         "PV": "conv_elec_pv",
@@ -96,14 +114,16 @@ def get_lf_vre(country: str) -> dict:
 class DataHandler:
     """Configuration file reading and extraction."""
 
-    def __init__(self, path) -> None:
+    def __init__(self, path, validate=False) -> None:
         """Initialise ConfigHandler object.
 
         Args:
             path (str): path to the configuration file.
+            validate (bool, optional): check that every value is numeric (or empty) at load, for debugging.
+                Otherwise, invalid values only fail when read. Defaults to False.
         """
         # Get model configuration
-        excel_file = pd.ExcelFile(path)
+        excel_file = pd.ExcelFile(path, engine=excel.ENGINE)
 
         fxe = {}
         params = {}
@@ -111,9 +131,9 @@ class DataHandler:
         # Convert configuration to dictionaries to improve speed
         for group in excel_file.sheet_names:
             if group in ["FiE", "FoE"]:
-                fxe[group] = pd.read_excel(path, group, index_col=0)
+                fxe[group] = excel_file.parse(group, index_col=0)
             else:
-                sheet_df = pd.read_excel(path, sheet_name=group)
+                sheet_df = excel_file.parse(group)
                 for entity_id in sheet_df.columns.drop(CNF_INDEX):
                     if entity_id in params:
                         raise ValueError("Found duplicate id", entity_id, "in sheet", group)
@@ -138,8 +158,82 @@ class DataHandler:
 
                         params[entity_id][data_type] = entity_df.to_dict()[entity_id]
 
+        # Values must be numeric (or empty). Invalid values fail at load when validating (debugging),
+        # otherwise they are kept aside, out of the lookups below, and every getter raises when reading them
+        invalid = {}
+        for entity_id, entity_params in params.items():
+            for data_type, data in entity_params.items():
+                for key, value in data.items():
+                    if not isinstance(value, Number):
+                        if validate:
+                            raise ValueError("Invalid value", value, "for", entity_id, data_type, key)
+                        invalid[(data_type, entity_id, key)] = value
+
+        # Flat lookup of non-empty values, keyed by (Type, Entity, Parameter, [Flow], [Year])
+        flat = {}
+        for entity_id, entity_params in params.items():
+            for data_type, data in entity_params.items():
+                for key, value in data.items():
+                    if isinstance(value, Number) and value == value:  # Skip invalid and NaN values
+                        key = key if isinstance(key, tuple) else (key,)
+                        flat[(data_type, entity_id, *key)] = value
+
+        # Annual values as arrays over a common year range, indexed by [Entity][Parameter, (Flow)][Year - Y0]
+        # Each series has a mask of the years its entity actually defines, so undefined years still raise
+        years = sorted(
+            {int(key[-1]) for p in params.values() for t in ["annual", "annual_fxe"] for key in p.get(t, {})}
+        )
+        year_0 = years[0] if years else 0
+        n_years = years[-1] - year_0 + 1 if years else 0
+        annual, annual_mask = {}, {}
+        annual_fxe, annual_fxe_mask = {}, {}
+        for entity_id, entity_params in params.items():
+            annual[entity_id], annual_mask[entity_id] = {}, {}
+            for (parameter, year), value in entity_params.get("annual", {}).items():
+                series = annual[entity_id].setdefault(parameter, np.full(n_years, np.nan))
+                mask = annual_mask[entity_id].setdefault(parameter, np.zeros(n_years, dtype=bool))
+                if isinstance(value, Number):
+                    series[int(year) - year_0] = value
+                    mask[int(year) - year_0] = True
+            annual_fxe[entity_id], annual_fxe_mask[entity_id] = {}, {}
+            for (parameter, flow, year), value in entity_params.get("annual_fxe", {}).items():
+                series = annual_fxe[entity_id].setdefault((parameter, flow), np.full(n_years, np.nan))
+                mask = annual_fxe_mask[entity_id].setdefault((parameter, flow), np.zeros(n_years, dtype=bool))
+                if isinstance(value, Number):
+                    series[int(year) - year_0] = value
+                    mask[int(year) - year_0] = True
+
+        # Configuration options as a table indexed by entity, for set building
+        # The mask tells options an entity defines apart from options it lacks (both NaN in the table)
+        entity_cnf = {e: p.get("configuration", {}) for e, p in params.items()}
+        cnf_df = pd.DataFrame.from_dict(entity_cnf, orient="index")
+        cnf_defined = pd.DataFrame.from_dict({e: dict.fromkeys(c, True) for e, c in entity_cnf.items()}, orient="index")
+        cnf_defined = cnf_defined.notna()
+
         self.fxe = fxe
         self.params = params
+        self._cnf_df = cnf_df
+        self._cnf_defined = cnf_defined
+        self._flat = flat
+        self._annual = annual
+        self._annual_mask = annual_mask
+        self._annual_fxe = annual_fxe
+        self._annual_fxe_mask = annual_fxe_mask
+        self._invalid = invalid
+        self._y0 = year_0
+
+        # Configurations are read-only once loaded: memoise the getters used by constraint rules
+        self.check_cnf = functools.lru_cache(maxsize=None)(self.check_cnf)
+        self.get_const = functools.lru_cache(maxsize=None)(self.get_const)
+        self.get_annual = functools.lru_cache(maxsize=None)(self.get_annual)
+        self.get = functools.lru_cache(maxsize=None)(self.get)
+        self.get_fxe = functools.lru_cache(maxsize=None)(self.get_fxe)
+
+    def _check_invalid(self, data_type, entity_id, key):
+        """Raise if a configured value is not numeric."""
+        value = self._invalid.get((data_type, entity_id, key))
+        if value is not None:
+            raise ValueError("Invalid value", value, "for", entity_id, data_type, key)
 
     # ------------------------------------------------------------- #
     # Specific gets (stringent)
@@ -154,8 +248,8 @@ class DataHandler:
         except KeyError as exc:
             raise KeyError("Invalid key for", entity_id, parameter) from exc
 
-        assert np.isnan(value) or isinstance(value, Number), f"Invalid: {entity_id}, {parameter}"
-        return None if np.isnan(value) else value
+        self._check_invalid("configuration", entity_id, parameter)
+        return None if value != value else value  # NaN check
 
     def get_const(self, entity_id: str, parameter: str) -> Any:
         """Return configuration constants.
@@ -167,8 +261,8 @@ class DataHandler:
         except KeyError as exc:
             raise KeyError("Invalid key for", entity_id, parameter) from exc
 
-        assert isinstance(value, Number) or np.isnan(value), f"Invalid: {entity_id}, {parameter}"
-        return None if np.isnan(value) else value
+        self._check_invalid("constant", entity_id, parameter)
+        return None if value != value else value  # NaN check
 
     def get_const_fxe(self, entity_id, parameter, flow):
         """Return flow-specific constants.
@@ -180,60 +274,105 @@ class DataHandler:
         except KeyError as exc:
             raise KeyError("Invalid key for", entity_id, parameter, flow) from exc
 
-        assert isinstance(value, Number) or np.isnan(value), f"Invalid: {entity_id}, {parameter}, {flow}"
-        return None if np.isnan(value) else value
+        self._check_invalid("constant_fxe", entity_id, (parameter, flow))
+        return None if value != value else value  # NaN check
 
     def get_annual(self, entity_id, parameter, year):
         """Return historic values."""
-        value = self.params[entity_id]["annual"][(parameter, year)]
+        try:
+            series = self._annual[entity_id][parameter]
+        except KeyError as exc:
+            raise KeyError("Invalid key for", entity_id, parameter, year) from exc
+        mask = self._annual_mask[entity_id][parameter]
+        if not 0 <= year - self._y0 < len(series) or not mask[year - self._y0]:
+            self._check_invalid("annual", entity_id, (parameter, year))
+            raise KeyError("Invalid year for", entity_id, parameter, year)
 
-        assert isinstance(value, Number) or np.isnan(value), f"Invalid: {entity_id}, {parameter}, {year}"
-        return None if np.isnan(value) else value
+        value = series[year - self._y0]
+        return None if value != value else value.item()  # NaN check
 
     def get_annual_fxe(self, entity_id, parameter, flow, year):
         """Return flow-specific historic values."""
         # Trying to read empty annual data should cause an error to minimise bugs.
-        value = self.params[entity_id]["annual_fxe"][(parameter, flow, year)]
+        try:
+            series = self._annual_fxe[entity_id][(parameter, flow)]
+        except KeyError as exc:
+            raise KeyError("Invalid key for", entity_id, parameter, flow, year) from exc
+        mask = self._annual_fxe_mask[entity_id][(parameter, flow)]
+        if not 0 <= year - self._y0 < len(series) or not mask[year - self._y0]:
+            self._check_invalid("annual_fxe", entity_id, (parameter, flow, year))
+            raise KeyError("Invalid year for", entity_id, parameter, flow, year)
+
+        value = series[year - self._y0]
+        return None if value != value else value.item()  # NaN check
 
-        assert isinstance(value, Number) or np.isnan(value), f"Invalid: {entity_id}, {parameter}, {flow}, {year}"
-        return None if np.isnan(value) else value
+    # ------------------------------------------------------------- #
+    # Bulk gets
+    # ------------------------------------------------------------- #
+    def get_annual_series(self, entity_id, parameter, years) -> np.ndarray:
+        """Return historic values for several years at once.
+
+        Missing or empty values are returned as NaN, invalid ones raise.
+        """
+        if self._invalid:
+            for year in years:
+                self._check_invalid("annual", entity_id, (parameter, year))
+        index = np.asarray(years, dtype=int) - self._y0
+        values = np.full(len(index), np.nan)
+        series = self._annual[entity_id].get(parameter)
+        if series is not None:
+            in_range = (index >= 0) & (index < len(series))
+            values[in_range] = series[index[in_range]]
+        return values
 
     # ------------------------------------------------------------- #
-    # Generic gets  #TODO: needs rework. Should be a single dictionary with (Type, Param, Entity, Flow, Year)
+    # Generic gets
     # ------------------------------------------------------------- #
     def get(self, entity_id, parameter, year, trigger_error=False):
         """Get a parameter, checking constants first."""
-        value = None
-        found = False
-        if "annual" in self.params[entity_id] and (parameter, year) in self.params[entity_id]["annual"]:
-            found = True
-            value = self.get_annual(entity_id, parameter, year)
-        if value is None and "constant" in self.params[entity_id] and parameter in self.params[entity_id]["constant"]:
-            found = True
-            value = self.get_const(entity_id, parameter)
-        if not found and trigger_error:
-            raise KeyError("Parameter", parameter, "not found for", entity_id)
+        value = self._flat.get(("annual", entity_id, parameter, year))
+        if value is None:
+            self._check_invalid("annual", entity_id, (parameter, year))
+            value = self._flat.get(("constant", entity_id, parameter))
+        if value is None:
+            self._check_invalid("constant", entity_id, parameter)
+            # Empty or missing: validate against the nested configuration
+            entity_params = self.params[entity_id]
+            in_annual = (parameter, year) in entity_params.get("annual", {})
+            in_const = parameter in entity_params.get("constant", {})
+            if trigger_error and not (in_annual or in_const):
+                raise KeyError("Parameter", parameter, "not found for", entity_id)
         return value
 
     def get_fxe(self, entity_id, parameter, flow, year, trigger_error=False):
         """Get a FxE parameter, checking constants first."""
-        value = None
-        found = False
-        if "annual_fxe" in self.params[entity_id] and (parameter, flow, year) in self.params[entity_id]["annual_fxe"]:
-            found = True
-            value = self.get_annual_fxe(entity_id, parameter, flow, year)
+        value = self._flat.get(("annual_fxe", entity_id, parameter, flow, year))
         if value is None:
-            if "constant_fxe" in self.params[entity_id] and (parameter, flow) in self.params[entity_id]["constant_fxe"]:
-                found = True
-                value = self.get_const_fxe(entity_id, parameter, flow)
-        if not found and trigger_error:
-            raise KeyError("Parameter", parameter, "not found for", entity_id, "and", flow)
+            self._check_invalid("annual_fxe", entity_id, (parameter, flow, year))
+            value = self._flat.get(("constant_fxe", entity_id, parameter, flow))
+        if value is None:
+            self._check_invalid("constant_fxe", entity_id, (parameter, flow))
+            # Empty or missing: validate against the nested configuration
+            entity_params = self.params[entity_id]
+            in_annual = (parameter, flow, year) in entity_params.get("annual_fxe", {})
+            in_const = (parameter, flow) in entity_params.get("constant_fxe", {})
+            if trigger_error and not (in_annual or in_const):
+                raise KeyError("Parameter", parameter, "not found for", entity_id, "and", flow)
         return value
 
     # Configuration sets
     def build_cnf_set(self, entity_set: set, parameter: str):
         """Create a set where the given configuration is enabled."""
-        config_enabled = set()
-        config_enabled = [i for i in entity_set if self.check_cnf(i, parameter) == 1]
-
-        return set(config_enabled)
+        entity_ids = list(entity_set)
+        if not entity_ids:
+            return set()
+        # Unknown entities, or entities without the option, are configuration errors
+        defined = self._cnf_defined.reindex(index=entity_ids, columns=[parameter], fill_value=False)[parameter]
+        if not defined.all():
+            raise KeyError("Invalid key for", defined.index[~defined.to_numpy()][0], parameter)
+
+        if self._invalid:
+            for entity_id in entity_ids:
+                self._check_invalid("configuration", entity_id, parameter)
+        values = self._cnf_df.loc[entity_ids, parameter]
+        return set(values.index[values == 1])
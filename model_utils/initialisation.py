@@ -24,13 +24,6 @@ from model_utils import data_handler
 from model_generic import generic_expressions as gen_expr
 
 
-def _c_io_balance(model: pyo.ConcreteModel, flow_id: str, y: int, d: int, h: int):
-    """Balance inputs and outputs at every flow bus."""
-    outflows_prev = sum(model.fout[f, e, y, d, h] for (f, e) in model.FoE if f == flow_id)
-    inflows_next = sum(model.fin[f, e, y, d, h] for (f, e) in model.FiE if f == flow_id)
-    return outflows_prev == inflows_next
-
-
 def _discount_rates(model, y):
     discount = cnf.DATA.get_const("country", "discount_factor")
     return 1 / np.power(1 + discount, (y - model.Y0.first()))
@@ -70,6 +63,14 @@ def _init_sets(model: pyo.ConcreteModel) -> pyo.ConcreteModel:
     fxe = model.F * model.E
     model.FiE = pyo.Set(within=fxe, ordered=False, initialize={(f, e) for f in flows for e in f_in[f]})
     model.FoE = pyo.Set(within=fxe, ordered=False, initialize={(f, e) for f in flows for e in f_out[f]})
+    # Entities connected to each flow, to avoid scanning FiE/FoE in flow-specific rules
+    model.FiEbyF = pyo.Set(model.F, within=model.E, initialize=lambda _, f: f_in.get(f, []))
+    model.FoEbyF = pyo.Set(model.F, within=model.E, initialize=lambda _, f: f_out.get(f, []))
+    # Flows connected to each entity, to avoid scanning FiE/FoE in entity-specific rules
+    e_in = data_handler.get_flow_entity_dict(cnf.DATA.fxe["FiE"], by_entity=True)
+    e_out = data_handler.get_flow_entity_dict(cnf.DATA.fxe["FoE"], by_entity=True)
+    model.FiEbyE = pyo.Set(model.E, within=model.F, initialize=lambda _, e: e_in.get(e, []))
+    model.FoEbyE = pyo.Set(model.E, within=model.F, initialize=lambda _, e: e_out.get(e, []))
 
     return model
 
@@ -110,6 +111,24 @@ def _init_expressions(model: pyo.ConcreteModel) -> pyo.ConcreteModel:
     return model
 
 
+def _init_io_balance(model: pyo.ConcreteModel) -> pyo.ConcreteModel:
+    """Balance inputs and outputs at every flow bus.
+
+    Built in bulk: the connected entities are resolved once per flow instead of once per index.
+    """
+    model.c_io_balance = pyo.Constraint(model.F, model.Y, model.D, model.H)
+    for flow_id in model.F:
+        outflow_entities = list(model.FoEbyF[flow_id])
+        inflow_entities = list(model.FiEbyF[flow_id])
+        for y in model.Y:
+            for d in model.D:
+                for h in model.H:
+                    outflows_prev = sum(model.fout[flow_id, e, y, d, h] for e in outflow_entities)
+                    inflows_next = sum(model.fin[flow_id, e, y, d, h] for e in inflow_entities)
+                    model.c_io_balance[flow_id, y, d, h] = outflows_prev == inflows_next
+    return model
+
+
 def init_model() -> pyo.ConcreteModel:
     """Create model structure."""
     # Initialise model
@@ -118,8 +137,7 @@ def init_model() -> pyo.ConcreteModel:
     model = _init_variables(model)
     model = _init_parameters(model)
     model = _init_expressions(model)
-
-    model.c_io_balance = pyo.Constraint(model.F, model.Y, model.D, model.H, rule=_c_io_balance)
+    model = _init_io_balance(model)
 
     return model
 
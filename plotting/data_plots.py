@@ -8,13 +8,43 @@
 # https://www.apache.org/licenses/LICENSE-2.0
 # --------------------------------------------------------------------------- #
 """Graph generating utilities for model data."""
-import networkx as nx
+from importlib.util import find_spec
+
+import numpy as np
 import pandas as pd
 from pyomo.environ import ConcreteModel
 
 from model_utils.data_handler import DataHandler
 from plotting import fig_tools
 
+# The Rust-based rustworkx layout is much faster than the networkx one for large graphs, use it if installed.
+_HAS_RUSTWORKX = find_spec("rustworkx") is not None
+
+
+def _annual_values(handler: DataHandler, entity_ids: list, params, years) -> np.ndarray:
+    """Get historical values as an (entities, years) array.
+
+    Args:
+        params (str | list): parameter to read, or one parameter per entity.
+    """
+    if isinstance(params, str):
+        params = [params] * len(entity_ids)
+    years = list(years)
+    values = [[handler.get_annual(e, param, y) for y in years] for e, param in zip(entity_ids, params)]
+    return np.array(values, dtype=float).reshape(len(entity_ids), len(years))
+
+
+def _spring_layout(network) -> dict:
+    """Get spring layout node positions for a networkx graph."""
+    if not _HAS_RUSTWORKX:
+        import networkx as nx  # pylint: disable=import-outside-toplevel
+
+        return nx.spring_layout(network)
+    import rustworkx as rx  # pylint: disable=import-outside-toplevel
+
+    graph = rx.networkx_converter(network)
+    return {graph[i]: tuple(xy) for i, xy in rx.spring_layout(graph).items()}
+
 
 def plot_io_network(handler: DataHandler, labels=True):
     """Create a network graph using input/output dataframes.
@@ -24,15 +54,18 @@ def plot_io_network(handler: DataHandler, labels=True):
     Args:
         labels (bool, optional): Whether to include labels in the plot. Defaults to True.
     """
+    import networkx as nx  # pylint: disable=import-outside-toplevel
+
     inflow = handler.fxe["FiE"]
     outflow = handler.fxe["FoE"]
-    nodes = set(inflow.index) | set(inflow.columns) | set(outflow.index) | set(outflow.columns)
-    adjacency = pd.DataFrame(index=nodes, columns=nodes)
-    adjacency.update(inflow)
-    adjacency.update(outflow.T)
-    adjacency.fillna(0, inplace=True)
-    network = nx.from_pandas_adjacency(adjacency)
-    nx.draw_networkx(network, node_size=100, font_size=6, with_labels=labels)
+    # Flows go into entities (FiE) and entities output flows (FoE)
+    edges_in = inflow.stack().rename_axis(["target", "source"]).reset_index(name="weight")
+    edges_out = outflow.stack().rename_axis(["source", "target"]).reset_index(name="weight")
+    edges = pd.concat([edges_in, edges_out], ignore_index=True)
+    edges = edges[edges["weight"] != 0]
+    network = nx.from_pandas_edgelist(edges, edge_attr="weight", create_using=nx.DiGraph)
+    network.add_nodes_from(set(inflow.index) | set(inflow.columns) | set(outflow.index) | set(outflow.columns))
+    nx.draw_networkx(network, pos=_spring_layout(network), node_size=100, font_size=6, with_labels=labels)
 
 
 # --------------------------------------------------------------------------- #
@@ -41,23 +74,26 @@ def plot_io_network(handler: DataHandler, labels=True):
 def plot_flow_fout(model, handler: DataHandler, flow_ids: list, unit: str = "TWh"):
     """Plot the historical entity outflows at a flow node.
 
-    TODO: may not work properly for entities with multiple output efficiencies. Add a warning?
+    Entities connected to several of the given flows show their combined outflow.
     """
-    entity_ids = sorted({e for f, e in model.FoE if f in flow_ids})
-    value_df = pd.DataFrame(index=model.Y, columns=entity_ids, data=0)
+    years = tuple(model.Y)
+    flows = [f for f in set(flow_ids) if f in model.FoEbyF]
+    foe = [(f, e) for f in flows for e in model.FoEbyF[f]]
+    entity_ids = sorted({e for _, e in foe})
+    entity_idx = {e: j for j, e in enumerate(entity_ids)}
 
     # Gather values
-    for f in flow_ids:
-        for e in entity_ids:
-            for y in model.Y:
-                if e in model.Trades:
-                    activity = handler.get_annual(e, "actual_import", y)
-                else:
-                    activity = handler.get_annual(e, "actual_activity", y)
-                efficiency = handler.get_fxe(e, "output_efficiency", f, y)
-                value_df.loc[y, e] = activity * efficiency
+    trades = frozenset(model.Trades)
+    activity_keys = ["actual_import" if e in trades else "actual_activity" for e in entity_ids]
+    activity = _annual_values(handler, entity_ids, activity_keys, years)
+    efficiency = np.zeros((len(entity_ids), len(years)))
+    for f, e in foe:
+        efficiency[entity_idx[e]] += [handler.get_fxe(e, "output_efficiency", f, y) for y in years]
+    values = np.einsum("ey,ey->ye", activity, efficiency)
+    value_df = pd.DataFrame(values, index=years, columns=entity_ids, copy=False)
     # Plotting
-    axis = value_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = value_df.plot.area(linewidth=0)
     title = f"Hist. estimate:fout:{flow_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
@@ -67,23 +103,26 @@ def plot_flow_fout(model, handler: DataHandler, flow_ids: list, unit: str = "TWh
 def plot_flow_fin(model: ConcreteModel, handler: DataHandler, flow_ids: list, unit: str = "TWh"):
     """Plot the historical entity inflows at a flow node.
 
-    TODO: may not work properly for entities with multiple input efficiencies. Add a warning?
+    Entities connected to several of the given flows show their combined inflow.
     """
-    entity_ids = sorted({e for f, e in model.FiE if f in flow_ids})
-    value_df = pd.DataFrame(index=model.Y, columns=entity_ids, data=0)
+    years = tuple(model.Y)
+    flows = [f for f in set(flow_ids) if f in model.FiEbyF]
+    fie = [(f, e) for f in flows for e in model.FiEbyF[f]]
+    entity_ids = sorted({e for _, e in fie})
+    entity_idx = {e: j for j, e in enumerate(entity_ids)}
 
     # Gather values
-    for f in flow_ids:
-        for e in entity_ids:
-            for y in model.Y:
-                if e in model.Trades:
-                    activity = handler.get_annual(e, "actual_export", y)
-                else:
-                    activity = handler.get_annual(e, "actual_activity", y)
-                efficiency = handler.get_fxe(e, "input_efficiency", f, y)
-                value_df.loc[y, e] = activity * efficiency
+    trades = frozenset(model.Trades)
+    activity_keys = ["actual_export" if e in trades else "actual_activity" for e in entity_ids]
+    activity = _annual_values(handler, entity_ids, activity_keys, years)
+    efficiency = np.zeros((len(entity_ids), len(years)))
+    for f, e in fie:
+        efficiency[entity_idx[e]] += [handler.get_fxe(e, "input_efficiency", f, y) for y in years]
+    values = np.einsum("ey,ey->ye", activity, efficiency)
+    value_df = pd.DataFrame(values, index=years, columns=entity_ids, copy=False)
     # Plotting
-    axis = value_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = value_df.plot.area(linewidth=0)
     title = f"Hist. estimate:fout:{flow_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
@@ -93,89 +132,56 @@ def plot_flow_fin(model: ConcreteModel, handler: DataHandler, flow_ids: list, un
 # --------------------------------------------------------------------------- #
 # Group plots
 # --------------------------------------------------------------------------- #
-def plot_group_param(model: ConcreteModel, handler: DataHandler, param: str, group_ids: list, unit: str):
-    """Plot the historical new capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    param_df = pd.DataFrame(index=model.Y, columns=entity_ids)
+def _plot_group_bar(model: ConcreteModel, handler: DataHandler, param: str, group_ids: list, unit: str, name: str):
+    """Plot a historical parameter of the capacity entities in a group as stacked bars."""
+    years = tuple(model.Y)
+    entity_ids = fig_tools.group_entities(model.E, group_ids, within=model.Caps)
 
     # Gather values
-    for e in entity_ids:
-        param_df[e] = {y: handler.get_annual(e, param, y) for y in model.Y}
+    values = _annual_values(handler, entity_ids, param, years)
+    param_df = pd.DataFrame(values.T, index=years, columns=entity_ids, copy=False)
 
     # Plotting
-    axis = param_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:Tot Cap.:{group_ids}"
+    with fig_tools.plot_style():
+        axis = param_df.plot(kind="bar", stacked=True, width=0.8)
+    title = f"Modelled:{name}:{group_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
     return axis
 
 
-def plot_group_ctot(model: ConcreteModel, handler: DataHandler, group_ids: list, unit="GW"):
+def plot_group_param(model: ConcreteModel, handler: DataHandler, param: str, group_ids: list, unit: str):
     """Plot the historical new capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
+    return _plot_group_bar(model, handler, param, group_ids, unit, "Tot Cap.")
 
-    # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = handler.get_annual(e, "actual_capacity", y)
 
-    # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:Tot Cap.:{group_ids}"
-    fig_tools.prettify_plot(axis, title, unit)
-
-    return axis
+def plot_group_ctot(model: ConcreteModel, handler: DataHandler, group_ids: list, unit="GW"):
+    """Plot the historical new capacity of the entities in a group."""
+    return _plot_group_bar(model, handler, "actual_capacity", group_ids, unit, "Tot Cap.")
 
 
 def plot_group_cnew(model: ConcreteModel, handler: DataHandler, group_ids: list, unit="GW"):
     """Plot the historical new capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
-
-    # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = handler.get_annual(e, "actual_new_capacity", y)
-
-    # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:New Cap.:{group_ids}"
-    fig_tools.prettify_plot(axis, title, unit)
-
-    return axis
+    return _plot_group_bar(model, handler, "actual_new_capacity", group_ids, unit, "New Cap.")
 
 
 def plot_group_cret(model: ConcreteModel, handler: DataHandler, group_ids: list, unit="GW"):
     """Plot the historical retired capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
-
-    # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = handler.get_annual(e, "actual_retired_capacity", y)
-
-    # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:Ret Cap.:{group_ids}"
-    fig_tools.prettify_plot(axis, title, unit)
-
-    return axis
+    return _plot_group_bar(model, handler, "actual_retired_capacity", group_ids, unit, "Ret Cap.")
 
 
 def plot_group_act(model: ConcreteModel, handler: DataHandler, group_ids: list, unit="GW"):
     """Plot the activity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e})
-    act_df = pd.DataFrame(index=model.Y, columns=entity_ids)
+    years = tuple(model.Y)
+    entity_ids = fig_tools.group_entities(model.E, group_ids)
 
     # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            act_df.loc[y, e] = handler.get_annual(e, "actual_activity", y)
+    values = _annual_values(handler, entity_ids, "actual_activity", years)
+    act_df = pd.DataFrame(values.T, index=years, columns=entity_ids, copy=False)
 
     # Plotting
-    axis = act_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = act_df.plot.area(linewidth=0)
     title = f"Modelled:Activity:{group_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
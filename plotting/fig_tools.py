@@ -11,22 +11,44 @@
 
 Stick to generic functionality, do not put result-specific stuff in here.
 """
-import matplotlib.pyplot as plt
+import contextlib
+from typing import TYPE_CHECKING
 
-# Configure plot settings
-plt.rcParams["axes.prop_cycle"] = plt.cycler(color=plt.cm.tab20.colors)
+if TYPE_CHECKING:
+    import matplotlib.axes
 
 
-def inverted_legend(axis: plt.Axes, bbox_to_anchor=(1.05, 0.5)):
+@contextlib.contextmanager
+def plot_style():
+    """Apply the plot settings to the figures drawn within the context.
+
+    matplotlib is only imported when something is plotted, so non-plotting runs do not pay for it.
+    """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    with plt.rc_context({"axes.prop_cycle": plt.cycler(color=plt.cm.tab20.colors)}):
+        yield
+
+
+def inverted_legend(axis: "matplotlib.axes.Axes", bbox_to_anchor=(1.05, 0.5)):
     """Invert the labels in a matplotlib figure."""
     handles, labels = axis.get_legend_handles_labels()
     axis.legend(handles[::-1], labels[::-1], bbox_to_anchor=bbox_to_anchor, loc="center left")
 
 
-def prettify_plot(axis: plt.Axes, title: str, label: str):
+def prettify_plot(axis: "matplotlib.axes.Axes", title: str, label: str):
     """Make plot prettier by adding a legend, title and sorting the labels."""
     axis.set_title(title)
     axis.set_ylabel(label)
     inverted_legend(axis)
-    plt.tight_layout()
+    axis.figure.tight_layout()
     axis.autoscale()
+
+
+def group_entities(entities, group_ids: list, within=None) -> list:
+    """Get the sorted entities whose name contains any of the given group ids, optionally limited to a subset."""
+    if within is not None:
+        within = frozenset(within)
+        entities = (e for e in entities if e in within)
+    group_ids = tuple(group_ids)
+    return sorted(e for e in entities if any(group in e for group in group_ids))
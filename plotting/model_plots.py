@@ -8,6 +8,9 @@
 # https://www.apache.org/licenses/LICENSE-2.0
 # --------------------------------------------------------------------------- #
 """Graph generating utilities for RESTORE model outputs."""
+import itertools
+
+import numpy as np
 import pandas as pd
 import pyomo.environ as pyo
 
@@ -15,9 +18,47 @@ from model_utils.data_handler import DataHandler
 from plotting import fig_tools
 
 
+def _var_to_array(var: pyo.Var, *index_sets) -> np.ndarray:
+    """Extract the values of an indexed variable into a dense array, with one axis per index set.
+
+    Unset values are returned as NaN.
+    Reads the variable data dict directly, skipping the index normalisation of var[idx] on every element.
+    """
+    index_sets = [[i if isinstance(i, tuple) else (i,) for i in s] for s in index_sets]
+    keys = (tuple(itertools.chain.from_iterable(idx)) for idx in itertools.product(*index_sets))
+    if var.dim() == 1:
+        keys = (key[0] for key in keys)
+    # pylint: disable=protected-access
+    var_data = var._data
+    values = np.array([var_data[key]._value for key in keys], dtype=float)
+    return values.reshape([len(s) for s in index_sets])
+
+
+def _annual_totals(model: pyo.ConcreteModel, var: pyo.Var, *index_sets) -> np.ndarray:
+    """Aggregate a (..., Y, D, H) variable into annual totals, as done by the e_TotalAnnual* expressions."""
+    years, days = tuple(model.Y), tuple(model.D)
+    day_lengths = np.array([[model.DL[y, d]() for d in days] for y in years])
+    values = _var_to_array(var, *index_sets, years, days, model.H)
+    # Time correction: hourly values weighted by day and hour lengths
+    return np.einsum("...ydh,yd->...y", values, day_lengths) * pyo.value(model.HL)
+
+
+def _modelled_year_map(model: pyo.ConcreteModel) -> dict:
+    """Map each year in YALL to the modelled year it takes its values from (the last one up to it)."""
+    year_map = {}
+    years = frozenset(model.Y)
+    y = model.Y.first()
+    for y_x in model.YALL:
+        if y_x in years:
+            y = y_x
+        year_map[y_x] = y
+    return year_map
+
+
 def _add_historical(axis, model: pyo.ConcreteModel, handler: DataHandler, flow: list):
-    historical_data = [handler.get_annual(flow, "actual_flow", y) for y in model.YALL]
-    historical_ref = pd.Series(data=historical_data, index=model.YALL, name="Historical total")
+    years_all = tuple(model.YALL)
+    historical_data = handler.get_annual_series(flow, "actual_flow", years_all)
+    historical_ref = pd.Series(data=historical_data, index=years_all, name="Historical total")
     axis = historical_ref.plot.line(ax=axis, color="black", linestyle="-.")
     return axis
 
@@ -27,21 +68,24 @@ def _add_historical(axis, model: pyo.ConcreteModel, handler: DataHandler, flow:
 # --------------------------------------------------------------------------- #
 def plot_flow_fout(model, handler: DataHandler, flow_ids: list, unit: str = "TWh", hist: str = None):
     """Plot the modelled entity out flows at a flow node."""
-    entity_ids = sorted({e for f, e in model.FoE if f in flow_ids})
-    value_df = pd.DataFrame(index=model.YALL, columns=entity_ids, data=0)
+    flows = [f for f in set(flow_ids) if f in model.FoEbyF]
+    foe = [(f, e) for f in flows for e in model.FoEbyF[f]]
+    entity_ids = sorted({e for _, e in foe})
+    entity_idx = {e: j for j, e in enumerate(entity_ids)}
+    y_idx = {y: i for i, y in enumerate(model.Y)}
+    year_map = _modelled_year_map(model)
+    year_pos = [y_idx[y] for y in year_map.values()]
 
     # Gather values
-    for f, e in model.FoE:
-        if f in flow_ids:
-            y = model.Y.first()
-            for y_x in model.YALL:
-                if y_x in model.Y:
-                    y = y_x
-                sum_fout = model.e_TotalAnnualOutflow[f, e, y]()
-                value_df.loc[y_x, e] += sum_fout  # time correction
-    value_df = abs(value_df)  # Get rid of negative near-zero tolerances
+    sum_fout = _annual_totals(model, model.fout, foe)
+    entity_rows = np.array([entity_idx[e] for _, e in foe], dtype=int)
+    values = np.zeros((len(entity_ids), len(year_pos)))
+    np.add.at(values, entity_rows, sum_fout[:, year_pos])  # Sum each entity's flows
+    values = np.abs(values)  # Get rid of negative near-zero tolerances
+    value_df = pd.DataFrame(values.T, index=tuple(year_map), columns=entity_ids, copy=False)
     # Plotting
-    axis = value_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = value_df.plot.area(linewidth=0)
     if hist:
         _add_historical(axis, model, handler, hist)
     title = f"Modelled:flow:{flow_ids}"
@@ -52,21 +96,24 @@ def plot_flow_fout(model, handler: DataHandler, flow_ids: list, unit: str = "TWh
 
 def plot_flow_fin(model, handler: DataHandler, flow_ids: list, unit: str = "TWh", hist: str = None):
     """Plot the modelled entity in flows at a flow node."""
-    entity_ids = sorted({e for f, e in model.FiE if f in flow_ids})
-    value_df = pd.DataFrame(index=model.YALL, columns=entity_ids, data=0)
+    flows = [f for f in set(flow_ids) if f in model.FiEbyF]
+    fie = [(f, e) for f in flows for e in model.FiEbyF[f]]
+    entity_ids = sorted({e for _, e in fie})
+    entity_idx = {e: j for j, e in enumerate(entity_ids)}
+    y_idx = {y: i for i, y in enumerate(model.Y)}
+    year_map = _modelled_year_map(model)
+    year_pos = [y_idx[y] for y in year_map.values()]
 
     # Gather values
-    for f, e in model.FiE:
-        if f in flow_ids:
-            y = model.Y.first()
-            for y_x in model.YALL:
-                if y_x in model.Y:
-                    y = y_x
-                sum_fin = model.e_TotalAnnualInflow[f, e, y]()
-                value_df.loc[y_x, e] += sum_fin  # time correction
-    value_df = abs(value_df)  # Get rid of negative near-zero tolerances
+    sum_fin = _annual_totals(model, model.fin, fie)
+    entity_rows = np.array([entity_idx[e] for _, e in fie], dtype=int)
+    values = np.zeros((len(entity_ids), len(year_pos)))
+    np.add.at(values, entity_rows, sum_fin[:, year_pos])  # Sum each entity's flows
+    values = np.abs(values)  # Get rid of negative near-zero tolerances
+    value_df = pd.DataFrame(values.T, index=tuple(year_map), columns=entity_ids, copy=False)
     # Plotting
-    axis = value_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = value_df.plot.area(linewidth=0)
     if hist:
         _add_historical(axis, model, handler, hist)
     title = f"Modelled:Input:{flow_ids}"
@@ -78,72 +125,54 @@ def plot_flow_fin(model, handler: DataHandler, flow_ids: list, unit: str = "TWh"
 # --------------------------------------------------------------------------- #
 # Group plots
 # --------------------------------------------------------------------------- #
-def plot_group_ctot(model, group_ids: list, unit="GW"):
-    """Plot the modelled total capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
+def _plot_group_cap(model, var: pyo.Var, group_ids: list, unit: str, name: str):
+    """Plot a modelled capacity variable of the entities in a group as stacked bars."""
+    years = tuple(model.Y)
+    entity_ids = fig_tools.group_entities(model.E, group_ids, within=model.Caps)
 
     # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = model.ctot[e, y].value
+    values = _var_to_array(var, entity_ids, years)
+    cap_df = pd.DataFrame(values.T, index=years, columns=entity_ids, copy=False)
 
     # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:Tot Cap.:{group_ids}"
+    with fig_tools.plot_style():
+        axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
+    title = f"Modelled:{name}:{group_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
     return axis
 
 
-def plot_group_cnew(model, group_ids: list, unit="GW"):
-    """Plot the modelled new capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
-
-    # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = model.cnew[e, y].value
+def plot_group_ctot(model, group_ids: list, unit="GW"):
+    """Plot the modelled total capacity of the entities in a group."""
+    return _plot_group_cap(model, model.ctot, group_ids, unit, "Tot Cap.")
 
-    # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:New Cap.:{group_ids}"
-    fig_tools.prettify_plot(axis, title, unit)
 
-    return axis
+def plot_group_cnew(model, group_ids: list, unit="GW"):
+    """Plot the modelled new capacity of the entities in a group."""
+    return _plot_group_cap(model, model.cnew, group_ids, unit, "New Cap.")
 
 
 def plot_group_cret(model, group_ids: list, unit="GW"):
     """Plot the modelled retired capacity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e and e in model.Caps})
-    cap_df = pd.DataFrame(index=model.Y, columns=entity_ids)
-
-    # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            cap_df.loc[y, e] = model.cret[e, y].value
-
-    # Plotting
-    axis = cap_df.plot(kind="bar", stacked=True, width=0.8)
-    title = f"Modelled:New Cap.:{group_ids}"
-    fig_tools.prettify_plot(axis, title, unit)
-
-    return axis
+    return _plot_group_cap(model, model.cret, group_ids, unit, "New Cap.")
 
 
 def plot_group_act(model, group_ids: list, unit="GW"):
     """Plot the activity of the entities in a group."""
-    entity_ids = sorted({e for group in group_ids for e in model.E if group in e})
-    act_df = pd.DataFrame(index=model.Y, columns=entity_ids)
+    years = tuple(model.Y)
+    entity_ids = fig_tools.group_entities(model.E, group_ids)
 
     # Gather values
-    for e in entity_ids:
-        for y in model.Y:
-            act_df.loc[y, e] = sum(model.DL[y, d]() * model.a[e, y, d, h].value for d in model.D for h in model.H)
+    days = tuple(model.D)
+    day_lengths = np.array([[model.DL[y, d]() for d in days] for y in years])
+    values = _var_to_array(model.a, entity_ids, years, days, model.H)
+    values = np.einsum("eydh,yd->ey", values, day_lengths)
+    act_df = pd.DataFrame(values.T, index=years, columns=entity_ids, copy=False)
 
     # Plotting
-    axis = act_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = act_df.plot.area(linewidth=0)
     title = f"Modelled:Activity:{group_ids}"
     fig_tools.prettify_plot(axis, title, unit)
 
@@ -152,10 +181,12 @@ def plot_group_act(model, group_ids: list, unit="GW"):
 
 def plot_act(model, entity_id, unit="GW"):
     """Plot the activity of a single entity."""
-    act = [model.e_TotalAnnualActivity[entity_id, y]() for y in model.Y]
-    act_df = pd.Series(index=model.Y, name=entity_id, data=act)
+    years = tuple(model.Y)
+    act = [model.e_TotalAnnualActivity[entity_id, y]() for y in years]
+    act_df = pd.Series(index=years, name=entity_id, data=act)
 
     # Plotting
-    axis = act_df.plot.area(linewidth=0)
+    with fig_tools.plot_style():
+        axis = act_df.plot.area(linewidth=0)
     title = f"Modelled:Activity:{entity_id}"
     fig_tools.prettify_plot(axis, title, unit)